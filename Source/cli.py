@@ -1,35 +1,50 @@
 import click
-from datetime import date
+from datetime import date, datetime
+from functools import lru_cache
 from typing import Optional
 import sqlalchemy
-from rich.console import Console
-from rich.table import Table
-import wcwidth
+import unicodedata
 
 
 from models import DailyHabit, WeeklyHabit, HabitInstance
 import database
 
 # ---------- display-width helpers (emoji-aware) ----------
-try:
-    from wcwidth import wcwidth
-except ImportError:
-    def wcwidth(c):
-        return 1  # naive fallback if wcwidth isn't installed
-
+def wcwidth(c: str) -> int:
+    if unicodedata.category(c) in ("Mn", "Me", "Cf"):
+        return 0  # combining marks and format characters (e.g. variation selectors)
+    if unicodedata.east_asian_width(c) in ("W", "F"):
+        return 2  # wide / fullwidth characters, including most emoji
+    if "\U0001D300" <= c <= "\U0001D356":
+        return 2  # Tai Xuan Jing symbols (e.g. 𝌵) are wide since Unicode 15, newer than some Pythons' tables
+    return 1
+
+@lru_cache(maxsize=1024)
 def display_len(s: str) -> int:
-    return sum(max(wcwidth(c), 0) for c in s)
+    if s.isascii():
+        return len(s)  # pure ASCII: every character is one column wide
+    return sum(wcwidth(c) for c in s)
 
 def pad_display(s: str, target: int) -> str:
-    pad = target - display_len(s)
-    return s + (" " * pad if pad > 0 else "")
+    # ljust counts code points, so widen the target by the difference to the display width
+    return s.ljust(target - display_len(s) + len(s))
+
+# ---------- date formatting helpers ----------
+@lru_cache(maxsize=512)
+def _fmt_ymd(d: date) -> str:
+    return f"{d.year:04d}-{d.month:02d}-{d.day:02d}"  # listings repeat the same few dates many times
+
+def _fmt_ymd_hm(dt: datetime) -> str:
+    return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}"
 
 # ---------- custom group with fixed column alignment ----------
 class FixedWidthGroup(click.Group):
-    EMOJI_PREFIXES = {"✨", "✅", "🗑️", "𝌵", "📋", "📊", "🏆"}
+    # emoji -> display width, measured once when the class is defined
+    EMOJI_PREFIXES = {e: display_len(e) for e in ("✨", "✅", "🗑️", "𝌵", "📋", "📊", "🏆")}
 
     def format_commands(self, ctx, formatter):
-        rows = []  # each entry: (name, emoji, rest_of_help)
+        rows = []  # each entry: (name, emoji, emoji_width, rest_of_help)
+        max_name_width = max_emoji_width = 0  # column widths, tracked while collecting rows
         for name in self.list_commands(ctx):
             cmd = self.get_command(ctx, name)
             if cmd is None:
@@ -38,25 +53,26 @@ class FixedWidthGroup(click.Group):
             short_help = " ".join(short_help.split())  # collapse internal whitespace/newlines
 
             emoji = ""
+            emoji_width = 0
             rest = short_help
             if short_help:
                 first_part, *rest_parts = short_help.split(" ", 1)
-                if first_part in self.EMOJI_PREFIXES:
+                emoji_width = self.EMOJI_PREFIXES.get(first_part, 0)
+                if emoji_width:
                     emoji = first_part
                     rest = rest_parts[0] if rest_parts else ""
-            rows.append((name, emoji, rest))
+            rows.append((name, emoji, emoji_width, rest))
+            max_name_width = max(max_name_width, display_len(name))
+            max_emoji_width = max(max_emoji_width, emoji_width)
 
         if not rows:
             return
 
-        max_name_width = max(display_len(name) for name, _, _ in rows)
-        max_emoji_width = max(display_len(emoji) for _, emoji, _ in rows) if any(e for _, e, _ in rows) else 0
-
         with formatter.section("Commands"):
-            for name, emoji, rest in rows:
+            for name, emoji, emoji_width, rest in rows:
                 name_padded = pad_display(name, max_name_width)
                 if emoji:
-                    emoji_padded = pad_display(emoji, max_emoji_width)
+                    emoji_padded = emoji.ljust(len(emoji) + max_emoji_width - emoji_width)
                     line = f"  {name_padded}  {emoji_padded}  {rest}"
                 else:
                     # no emoji, align as if empty column
@@ -74,16 +90,28 @@ CONTEXT_SETTINGS = {"max_content_width": 160}
 )
 def cli():
     """📝 Habit Tracker CLI"""
-    pass
+    database.init_db()
+
 
 
+@lru_cache(maxsize=None)
+def _console():
+    """
+    Returns the shared Rich console, importing Rich on first use only.
+    """
+    from rich.console import Console
+    return Console()
 
-console = Console()
+_last_backfill_date: Optional[date] = None  # day of the last backfill run in this process
 
 def ensure_up_to_date(f):
     @click.pass_context
     def wrapper(ctx, *args, **kwargs):
-        database.backfill_instances()
+        global _last_backfill_date
+        today = date.today()
+        if _last_backfill_date != today:    # backfill at most once per day
+            database.backfill_instances()
+            _last_backfill_date = today
         return ctx.invoke(f, *args, **kwargs)
     return wrapper
 
@@ -125,40 +153,47 @@ def add_habit(name : str, start_date : date, period_type : str, description : st
         description (str, optional): An optional description of the habit. Defaults to None.
         weekday (Optional[int], optional): The weekday for weekly habits (0=Monday, 6=Sunday). Defaults to None.
     """
+    global _last_backfill_date
     try:
         if period_type == 'daily':
             habit = DailyHabit(name=name, description=description)
         elif period_type == 'weekly':
             if weekday is None:
-                console.print("[bold red]Error: A weekday must be provided for weekly habits.[/bold red]")
+                _console().print("[bold red]Error: A weekday must be provided for weekly habits.[/bold red]")
                 return
             
             weekday_int = int(weekday)
             if not 0 <= weekday_int <= 6:
-                console.print("[bold red]Error: Weekday must be an integer between 0 (Monday) and 6 (Sunday).[/bold red]")
+                _console().print("[bold red]Error: Weekday must be an integer between 0 (Monday) and 6 (Sunday).[/bold red]")
                 return
             habit = WeeklyHabit(name=name, description=description, weekday=weekday_int)
 
-        database.save_habit(habit)
-        
-        start_date_obj = start_date.date()
-
-        if period_type == "weekly":
-            start_date_obj = habit.first_period_start(after=start_date_obj)
+        # Save the habit and its first instance in a single transaction
+        with database.SessionLocal() as session:
+            database.save_habit(habit, session)
             
-        habit_instance = HabitInstance(habit=habit, period_start=start_date_obj)
-        database.save_instance(habit_instance)
+            start_date_obj = start_date.date()
+
+            if period_type == "weekly":
+                start_date_obj = habit.first_period_start(after=start_date_obj)
+                
+            habit_instance = HabitInstance(habit=habit, period_start=start_date_obj)
+            database.save_instance(habit_instance, session)
+            session.commit()
+        
+        # the new habit may start in the past, so the next command has to backfill again
+        _last_backfill_date = None
         
-        console.print(f'Habit "[bold green]{name}[/bold green]" added successfully!')
+        _console().print(f'Habit "[bold green]{name}[/bold green]" added successfully!')
 
     except ValueError as e:
-        console.print(f"[bold red]Error: {e}[/bold red]")
+        _console().print(f"[bold red]Error: {e}[/bold red]")
     except TypeError:
-        console.print("[bold red]Error: Weekday must be an integer.[/bold red]")
+        _console().print("[bold red]Error: Weekday must be an integer.[/bold red]")
     except sqlalchemy.exc.IntegrityError:
-        console.print(f"[bold red]Error: A habit with the name '{name}' already exists.[/bold red]")
+        _console().print(f"[bold red]Error: A habit with the name '{name}' already exists.[/bold red]")
     except Exception as e:
-        console.print(f"[bold red]An unexpected error occurred: {e}[/bold red]")
+        _console().print(f"[bold red]An unexpected error occurred: {e}[/bold red]")
     
     
     
@@ -180,11 +215,13 @@ def list_all_habits(habit_type: str = "all"):
         habit_type (str, optional): Filter habits by type ('all', 'daily', or 'weekly'). Defaults to "all".
     """
     p = None if habit_type == "all" else habit_type.lower()     # Filter by type"
-    habits = database.get_all_habits(period=p)
+    habits = database.get_all_habits_rows(period=p)
     if not habits:
-        console.print("No habits found.")
+        _console().print("No habits found.")
         return
     
+    from rich.table import Table
+    
     table = Table(title="All Habits")
     table.add_column("ID", style="cyan", no_wrap=True)
     table.add_column("Name", style="magenta")
@@ -199,7 +236,7 @@ def list_all_habits(habit_type: str = "all"):
             h.date_created.date().isoformat()
         )
     
-    console.print(table)
+    _console().print(table)
        
 @cli.command("list-all-active-habits", short_help="𝌵 \b Retrieves all active habit instances and displays them in a table.")
 @click.option(
@@ -216,14 +253,14 @@ def list_all_active_habits(name : str = None):
     Args:
         name (str, optional): An optional name to filter active habits. Defaults to None.
     """
-    instances = database.get_all_active_habits(name=name)  # Get all active habit instances, optionally filtered by name
-    # Sort by the date (earliest first)
-    instances.sort(key=lambda inst: inst.period_start)
+    instances = database.get_all_active_habits(name=name)  # Get all active habit instances (earliest first), optionally filtered by name
     
     if not instances:
-        console.print("No active habits found.")
+        _console().print("No active habits found.")
         return
 
+    from rich.table import Table
+    
     table = Table(title="Active Habits")
     table.add_column("ID", style="cyan", no_wrap=True)
     table.add_column("Name", style="magenta")
@@ -233,32 +270,30 @@ def list_all_active_habits(name : str = None):
     table.add_column("Due", style="red")
     table.add_column("Completed", style="bold green")
 
-    for instance in instances:
-        done = (
-            instance.completed_at.strftime("%Y-%m-%d %H:%M")
-            if instance.completed_at else "[bold red]Not completed[/bold red]"
-        )
-        weekday = (
-            str(instance.habit.weekday)
-            if isinstance(instance.habit, WeeklyHabit) and instance.habit.weekday is not None
-            else "N/A"
-        )
-        table.add_row(
+    rows = [
+        (
             str(instance.id)[:2] + "..." + str(instance.id)[-2:],
             instance.habit.name,
             instance.habit.type,
-            weekday,
-            instance.period_start.strftime("%Y-%m-%d"),
-            instance.due_date.strftime("%Y-%m-%d") if instance.due_date else "No due date",
-            done
+            # only weekly habits carry a weekday, daily ones leave it as None
+            str(w) if (w := getattr(instance.habit, "weekday", None)) is not None else "N/A",
+            _fmt_ymd(instance.period_start),
+            _fmt_ymd(instance.due_date) if instance.due_date else "No due date",
+            _fmt_ymd_hm(instance.completed_at)
+            if instance.completed_at else "[bold red]Not completed[/bold red]"
         )
+        for instance in instances
+    ]
+    for row in rows:
+        table.add_row(*row)
     
-    console.print(table)
+    _console().print(table)
 
 @cli.command("complete-task", short_help="✅ Marks a specific habit instance as completed.")
 @click.argument("name", metavar="NAME")
 @click.option(
     "--date", "-d",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
     default=None,
     help="The date for which to mark the habit as completed (YYYY-MM-DD). Defaults to today."
 )
@@ -272,21 +307,22 @@ def complete_task(name: str = None, date : Optional[date] = None):
         date (Optional[date], optional): The date to complete the task. Defaults to None.
     """
     if not name:
-        console.print("[bold red]Please provide a habit instance ID to complete.[/bold red]")
+        _console().print("[bold red]Please provide a habit instance ID to complete.[/bold red]")
         return
     
     try:
-        database.complete_task(name, date)
-        console.print(f"Habit instance [bold green]{name}[/bold green] marked as completed!")
+        # click parses the option into a datetime; the database compares plain dates
+        database.complete_task(name, date.date() if date else None)
+        _console().print(f"Habit instance [bold green]{name}[/bold green] marked as completed!")
     except ValueError as e:
         # User-facing errors (e.g., "habit not found")
-        console.print(f"[bold red]Error: {e}[/bold red]")
+        _console().print(f"[bold red]Error: {e}[/bold red]")
     except sqlalchemy.exc.SQLAlchemyError as e:
         # Database-level errors
-        console.print(f"[bold red]Database error: Could not complete the operation. Details: {e}[/bold red]")
+        _console().print(f"[bold red]Database error: Could not complete the operation. Details: {e}[/bold red]")
     except Exception as e:
         # Catch any other unexpected errors
-        console.print(f"[bold red]An unexpected error occurred: {e}[/bold red]")
+        _console().print(f"[bold red]An unexpected error occurred: {e}[/bold red]")
 
         
 @cli.command("show-longest-streak", short_help="🏆 Shows the longest streak for a specific habit or the best streak among all habits.")
@@ -305,11 +341,12 @@ def show_longest_streak(name: str = None):
                                 If not provided, shows the best streak among all habits. Defaults to None.
     """
     if not name:
-        habits      = database.get_all_habits()
-        instances   = database.get_all_active_habits()
+        habits = database.get_habits_with_instances()
 
-        result = database.longest_streak_all(habits, instances)
-        console.print(f"Overall best streak: [bold green]{result['max_of_all']}[/bold green]")
+        result = database.longest_streak_all(habits)
+        
+        from rich.console import Group
+        from rich.table import Table
         
         table = Table(title="Streaks Per Habit")
         table.add_column("Habit", style="magenta")
@@ -318,16 +355,20 @@ def show_longest_streak(name: str = None):
         for h, s in result["per_habit"].items():
             table.add_row(h, str(s))
         
-        console.print(table)
+        # Render the summary line and the table in a single print/flush
+        _console().print(Group(
+            f"Overall best streak: [bold green]{result['max_of_all']}[/bold green]",
+            table
+        ))
         return
     
     habit = database.get_habit_by_name(name)
     
     try:
         streak = database.current_streak_for_habit(habit=habit)
-        console.print(f"Longest streak for '[bold blue]{name}[/bold blue]': [bold green]{streak}[/bold green] days")
+        _console().print(f"Longest streak for '[bold blue]{name}[/bold blue]': [bold green]{streak}[/bold green] days")
     except ValueError as e:
-        console.print(f"[bold red]Error: {e}[/bold red]")
+        _console().print(f"[bold red]Error: {e}[/bold red]")
         
         
 @cli.command("delete-habit", short_help="🗑️ Deletes a habit from the database.")
@@ -342,15 +383,15 @@ def delete_habit_cli(name: str):
     habit = database.get_habit_by_name(name)
     
     if not habit:
-        console.print(f"[bold red]Habit '{name}' not found.[/bold red]")
+        _console().print(f"[bold red]Habit '{name}' not found.[/bold red]")
         return
     
     habit_id = habit.id
     
     
     if not click.confirm(f"Are you sure you want to delete the habit '{name}'? This action cannot be undone.", default=False):
-        console.print("Deletion cancelled.")
+        _console().print("Deletion cancelled.")
         return
     
     database.delete_habit_by_id(habit_id)
-    console.print(f"Deleted habit [bold red]{name}[/bold red]")
+    _console().print(f"Deleted habit [bold red]{name}[/bold red]")
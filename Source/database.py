@@ -1,15 +1,18 @@
 # db_schema.py
-from sqlalchemy import create_engine, select, delete
+from sqlalchemy import Date, Row, bindparam, create_engine, event, func, select, delete, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import (
-    sessionmaker, selectinload, selectin_polymorphic
+    Session, sessionmaker, selectinload, raiseload, contains_eager
 )
 from typing import Optional
 import datetime
+import os
+from itertools import islice
 
 from datetime import date
 from pathlib import Path
 
-from models import Habit, DailyHabit, WeeklyHabit, HabitInstance, Base
+from models import Habit, DailyHabit, WeeklyHabit, HabitInstance, Base, _compute_due_date
 
 
 # Find this file’s directory
@@ -18,26 +21,78 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Build the DB path relative to it
 DB_PATH = BASE_DIR / "db/habits.db"
 
+# Marks that the tables of the current schema exist; bump the suffix when the models change
+SCHEMA_SENTINEL = DB_PATH.parent / ".schema_v1"
+
 if not DB_PATH.parent.exists():
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
 # Create the engine using that absolute path
+# SQL logging stays off unless explicitly requested via HABIT_SQL_ECHO
 engine = create_engine(
     f"sqlite:///{DB_PATH}",
-    echo=False,
+    echo=bool(os.environ.get("HABIT_SQL_ECHO")),
 )
 
-Base.metadata.create_all(engine)
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tunes every new SQLite connection for the CLI's many small writes.
+    WAL journaling with synchronous=NORMAL avoids a full fsync on each commit.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")   # 256 MiB
+    cursor.execute("PRAGMA cache_size=-20000")      # ~20 MB page cache, kept warm by the pooled connection
+    cursor.execute("PRAGMA busy_timeout=5000")      # wait up to 5s for a concurrent writer
+    cursor.execute("PRAGMA foreign_keys=ON")        # SQLite only enforces FKs (and cascades) when asked to
+    cursor.close()
+
+# Objects stay usable after commit; they are not expired and re-read on the next attribute access
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def init_db() -> None:
+    """
+    Creates any missing tables. Called once by the CLI instead of at import time.
 
-SessionLocal = sessionmaker(bind=engine)
+    Once the schema has been created, a sentinel file is left next to the database
+    so later invocations skip the table checks entirely.
+    """
+    if DB_PATH.exists() and SCHEMA_SENTINEL.exists():
+        return
+    Base.metadata.create_all(engine)
+    SCHEMA_SENTINEL.touch()
+
+# Statements used on every call are built once here; values are bound at execute time
+_SEL_HABIT_ID_BY_NAME = select(Habit.id).where(Habit.name == bindparam("name"))
+_SEL_HABIT_BY_NAME = select(Habit).where(Habit.name == bindparam("name"))
+_SEL_INSTANCE_ID_BY_HABIT_DATE = select(HabitInstance.id).where(
+    HabitInstance.habit_id     == bindparam("habit_id"),
+    HabitInstance.period_start == bindparam("period_start")
+)
+_SEL_LAST_PERIOD_STARTS = select(
+    HabitInstance.habit_id, func.max(HabitInstance.period_start)
+).group_by(HabitInstance.habit_id)
+_SEL_INSTANCE_BY_NAME_DATE = (
+    select(HabitInstance)
+    .join(HabitInstance.habit)
+    .where(Habit.name == bindparam("name"), HabitInstance.period_start == bindparam("period_start"))
+    .options(contains_eager(HabitInstance.habit))
+)
 
 
-def save_habit(habit: Habit) -> str:
+def save_habit(habit: Habit, session: Optional[Session] = None) -> str:
     """
     Saves a Habit to the database.
 
     Args:
         habit (Habit): The habit object to save.
+        session (Optional[Session], optional): An open session to add the habit to. The caller
+                                               is then responsible for committing. Defaults to None,
+                                               which saves the habit in its own transaction.
 
     Raises:
         ValueError: If a habit with the same name already exists.
@@ -45,47 +100,66 @@ def save_habit(habit: Habit) -> str:
     Returns:
         str: The ID of the saved habit.
     """
-    with SessionLocal() as session:
-        exists = session.execute(
-            select(Habit.id).where(Habit.name == habit.name)
-        ).scalar_one_or_none()
-        if exists:
-            raise ValueError(f"A habit named {habit.name!r} already exists.")
+    if session is None:
+        with SessionLocal() as session:
+            save_habit(habit, session)
+            session.commit()
+            return habit.id
 
-        session.add(habit)
-        session.commit()
-        session.refresh(habit)
-        return habit.id
+    exists = session.execute(
+        _SEL_HABIT_ID_BY_NAME, {"name": habit.name}
+    ).scalar_one_or_none()
+    if exists:
+        raise ValueError(f"A habit named {habit.name!r} already exists.")
+
+    session.add(habit)
+    return habit.id
         
 
-def save_instance(instance: HabitInstance) -> str:
+def save_instance(instance: HabitInstance, session: Optional[Session] = None) -> str:
     """
     Saves a HabitInstance to the database.
 
     Args:
         instance (HabitInstance): The habit instance object to save.
+        session (Optional[Session], optional): An open session to add the instance to. The caller
+                                               is then responsible for committing. Defaults to None,
+                                               which saves the instance in its own transaction.
 
     Returns:
         str: The ID of the saved instance.
     """
-    with SessionLocal() as session:
-        # 1) Look for an existing instance in the *habit_instances* table
-        stmt = (
-            select(HabitInstance.id)
-            .where(
-                HabitInstance.habit_id     == str(instance.habit_id),
-                HabitInstance.period_start == instance.period_start
-            )
+    if session is None:
+        with SessionLocal() as session:
+            instance_id = save_instance(instance, session)
+            session.commit()
+            return instance_id
+
+    # the habit may still be pending in this session; write it before the INSERT references it
+    session.flush()
+
+    # 1) Insert, unless the period already has an instance (uix_habit_period)
+    stmt = (
+        sqlite_insert(HabitInstance)
+        .values(
+            id=instance.id,
+            habit_id=instance.habit_id,
+            period_start=instance.period_start,
+            due_date=instance.due_date,
+            completed_at=instance.completed_at
         )
-        existing_id = session.execute(stmt).scalar_one_or_none()
-        if existing_id is not None:
-            return existing_id
-
-        # 2) Otherwise insert
-        session.add(instance)
-        session.commit()
-        session.refresh(instance)
-        return instance.id
+        .on_conflict_do_nothing(index_elements=["habit_id", "period_start"])
+        .returning(HabitInstance.id)
+    )
+    inserted_id = session.execute(stmt).scalar_one_or_none()
+    if inserted_id is not None:
+        return inserted_id
+
+    # 2) Otherwise return the id of the existing instance
+    return session.execute(
+        _SEL_INSTANCE_ID_BY_HABIT_DATE,
+        {"habit_id": instance.habit_id, "period_start": instance.period_start}
+    ).scalar_one()
         
 def complete_task(name: str, date : Optional[datetime.date] = None) -> None:
     """
@@ -102,56 +176,34 @@ def complete_task(name: str, date : Optional[datetime.date] = None) -> None:
         date = datetime.date.today()
     
     with SessionLocal() as session:     
-        # get habit id by name
-        stmt = select(Habit.id).where(Habit.name==name)
-        habit_id = session.execute(stmt).scalar_one_or_none()       
-        if not habit_id:
-            raise ValueError(f"No habit named {name!r}")
+        # get the instance for this habit name and date, together with its habit, in one query
+        instance = session.execute(
+            _SEL_INSTANCE_BY_NAME_DATE, {"name": name, "period_start": date}
+        ).scalar_one_or_none()
         
-        # get instance id by habit_id and date
-        stmt = select(HabitInstance.id).where(HabitInstance.habit_id==habit_id).where(HabitInstance.period_start==date)
-        instance_id = session.execute(stmt).scalar_one_or_none()
-        if not instance_id:
+        if instance is None:
+            # only on the error path: find out which of the two is missing
+            habit_id = session.execute(_SEL_HABIT_ID_BY_NAME, {"name": name}).scalar_one_or_none()
+            if not habit_id:
+                raise ValueError(f"No habit named {name!r}")
             raise ValueError(f"No instance for '{name}' on {date}")
         
-        # get the HabitInstance by id
-        instance = session.get(HabitInstance, instance_id)
+        instance_id = instance.id
         
-        if not instance:
-            raise ValueError(f"No HabitInstance with id={instance_id!r}")
-        elif instance.is_completed():
+        if instance.is_completed():
             raise ValueError(f"HabitInstance with id={instance_id!r} is already completed")
         else:
             # sets completed_at = now()
             instance.mark_completed()                   
-            session.commit()
-            session.refresh(instance)
             
-            instance_id = select(HabitInstance.id).where(HabitInstance.habit_id==habit_id).where(HabitInstance.period_start==date)
-            
-            period_start = instance.habit.next_period_start(instance.period_start)
             habit = instance.habit
+            next_start = habit.next_period_start(instance.period_start)
             
+            # create the following habit instance unless it already exists; same transaction, no lookup
+            save_instance(HabitInstance(habit=habit, period_start=next_start), session)
             
-            # Compute the next period (may be a datetime.datetime)
-            raw_next = instance.habit.next_period_start(instance.period_start)
-
-            # Normalize to a pure date for the SQL comparison:
-            if isinstance(raw_next, datetime.datetime):
-                lookup_date = raw_next.date()
-            else:
-                lookup_date = raw_next
-            
-            stmt = select(HabitInstance.id).where(HabitInstance.habit_id==habit_id).where(HabitInstance.period_start==lookup_date)
-            instance_id = session.execute(stmt).scalar_one_or_none()
-
-            if instance_id is None:
-                # create the following habit instance
-                new_instance = HabitInstance(
-                habit=habit,
-                period_start=period_start  # get next period start
-                )
-                save_instance(new_instance) 
+            # completion and the next instance are committed together
+            session.commit()
         
 def get_all_habits(period: Optional[str] = "all") -> list[Habit]:
     """
@@ -174,11 +226,33 @@ def get_all_habits(period: Optional[str] = "all") -> list[Habit]:
     else:
         stmt = select(Habit)
 
-    stmt = stmt.order_by(Habit.name)
+    # fail loudly on any stray lazy load of a relationship
+    stmt = stmt.options(raiseload("*")).order_by(Habit.name)
 
     with SessionLocal() as session:
         return session.scalars(stmt).all()
         
+def get_all_habits_rows(period: Optional[str] = "all") -> list[Row]:
+    """
+    Retrieves the display fields of all habits as plain rows, optionally filtered by period.
+
+    Args:
+        period (Optional[str], optional): The period to filter by ('daily' or 'weekly'). 
+                                          Defaults to "all".
+
+    Returns:
+        list[Row]: One (id, name, type, date_created) row per habit, ordered by name.
+    """
+    period_str = (period or "all").lower()
+
+    # plain column rows for listings: no ORM objects are built
+    stmt = select(Habit.id, Habit.name, Habit.type, Habit.date_created).order_by(Habit.name)
+    if period_str in ("daily", "weekly"):
+        stmt = stmt.where(Habit.type == period_str)
+
+    with SessionLocal() as session:
+        return session.execute(stmt).all()
+
 def get_all_active_habits(name : str = None) -> list[HabitInstance]:
     """
     Retrieves all active habit instances, optionally filtered by name.
@@ -187,16 +261,17 @@ def get_all_active_habits(name : str = None) -> list[HabitInstance]:
         name (str, optional): The name of the habit to filter by. Defaults to None.
 
     Returns:
-        list[HabitInstance]: A list of all active habit instances.
+        list[HabitInstance]: A list of all active habit instances, ordered by period start.
     """
-    # Build a query to fetch all HabitInstance rows, eagerly loading each instance’s related Habit
-    # plus any subclass‐specific columns for WeeklyHabit in a single round‐trip.
-    if name is None:
-        stmt = select(HabitInstance).options(selectinload(HabitInstance.habit), selectin_polymorphic(Habit, [WeeklyHabit]))
-    else:
-        stmt = select(HabitInstance).options(selectinload(HabitInstance.habit), selectin_polymorphic(Habit, [WeeklyHabit])).where(
-            HabitInstance.habit_id == get_habit_by_name(name).id
-        )
+    # Build a query to fetch all HabitInstance rows, eagerly loading each instance’s related Habit.
+    # With single-table inheritance `weekday` lives on the habits table, so subclasses load inline
+    # with their base row and need no separate polymorphic loader.
+    # raiseload("*") turns any other (lazy) relationship access into an error instead of a query per row
+    stmt = select(HabitInstance).options(selectinload(HabitInstance.habit), raiseload("*"))
+    if name is not None:
+        # filter by name in the same query instead of looking the habit up first
+        stmt = stmt.join(HabitInstance.habit).where(Habit.name == name)
+    stmt = stmt.order_by(HabitInstance.period_start)    # earliest first
     
     
     with SessionLocal() as session:
@@ -205,6 +280,19 @@ def get_all_active_habits(name : str = None) -> list[HabitInstance]:
 
 
 
+def get_habits_with_instances() -> list[Habit]:
+    """
+    Retrieves all habits together with their instances in a single round-trip.
+
+    Returns:
+        list[Habit]: A list of all habits, each with its `instances` already loaded.
+    """
+    stmt = select(Habit).options(selectinload(Habit.instances)).order_by(Habit.name)
+
+    with SessionLocal() as session:
+        return session.scalars(stmt).all()
+
+
 def prev_period_start(habit: Habit, date: date) -> date:
     """
     Calculates the start of the previous period for a given habit and date.
@@ -222,6 +310,66 @@ def prev_period_start(habit: Habit, date: date) -> date:
     return date - datetime.timedelta(days=7)
 
 
+def count_current_streak(habit: Habit, instances: list[HabitInstance], today: date) -> int:
+    """
+    Counts the current streak from a habit's instances without touching the database.
+
+    Args:
+        habit (Habit): The habit the instances belong to.
+        instances (list[HabitInstance]): The habit's instances up to today, newest first.
+        today (date): The date to calculate the streak up to.
+
+    Returns:
+        int: The current streak count.
+    """
+    if not instances:
+        return 0
+
+    streak = 0
+    
+    # If the most recent instance is today and not completed, check streak from yesterday.
+    start = 1 if instances[0].period_start == today and not instances[0].is_completed() else 0
+    
+    if start >= len(instances):
+        return 0
+        
+    # The first instance in our list to check is where the streak must begin.
+    expected_date = instances[start].period_start
+    
+    # walk the list in place instead of copying the remainder with a slice
+    for instance in islice(instances, start, None):
+        if instance.is_completed() and instance.period_start == expected_date:
+            streak += 1
+            expected_date = prev_period_start(habit, expected_date)
+        else:
+            # The streak is broken.
+            break
+            
+    return streak
+
+
+# Current streak computed in SQLite: number the instances newest first (skipping today's if it
+# is still open) and count the leading rows that are completed and exactly `step` days apart.
+_CURRENT_STREAK_SQL = text("""
+    WITH ordered AS (
+        SELECT period_start, completed_at,
+               ROW_NUMBER() OVER (ORDER BY period_start DESC) AS rn
+        FROM habit_instances
+        WHERE habit_id = :habit_id
+          AND period_start <= :today
+          AND NOT (period_start = :today AND completed_at IS NULL)
+    ),
+    checked AS (
+        SELECT rn,
+               completed_at IS NOT NULL
+               AND julianday(period_start) = julianday(FIRST_VALUE(period_start) OVER (ORDER BY rn)) - (rn - 1) * :step
+               AS in_streak
+        FROM ordered
+    )
+    SELECT COALESCE(MIN(CASE WHEN NOT in_streak THEN rn END) - 1, COUNT(*)) FROM checked
+""").bindparams(bindparam("today", type_=Date))
+
+
 def current_streak_for_habit(habit: Habit, today: Optional[date] = None) -> int:
     """
     Calculates the current streak for a given habit.
@@ -236,41 +384,13 @@ def current_streak_for_habit(habit: Habit, today: Optional[date] = None) -> int:
     if today is None:
         today = date.today()
 
-    with SessionLocal() as session:
-        # Get all instances for this habit up to today, in reverse order
-        stmt = (
-            select(HabitInstance)
-            .where(HabitInstance.habit_id == habit.id, HabitInstance.period_start <= today)
-            .order_by(HabitInstance.period_start.desc())
-        )
-        instances = session.scalars(stmt).all()
-
-        if not instances:
-            return 0
+    # same period length as prev_period_start
+    step = 1 if isinstance(habit, DailyHabit) else 7
 
-        streak = 0
-        
-        # If the most recent instance is today and not completed, check streak from yesterday.
-        if instances[0].period_start == today and not instances[0].is_completed():
-            instances_to_check = instances[1:]
-        else:
-            instances_to_check = instances
-        
-        if not instances_to_check:
-            return 0
-            
-        # The first instance in our list to check is where the streak must begin.
-        expected_date = instances_to_check[0].period_start
-        
-        for instance in instances_to_check:
-            if instance.is_completed() and instance.period_start == expected_date:
-                streak += 1
-                expected_date = prev_period_start(habit, expected_date)
-            else:
-                # The streak is broken.
-                break
-                
-        return streak
+    with SessionLocal() as session:
+        return session.execute(
+            _CURRENT_STREAK_SQL, {"habit_id": habit.id, "today": today, "step": step}
+        ).scalar_one()
 
 
 def get_habit_by_name(name: str) -> Optional[Habit]:
@@ -284,16 +404,34 @@ def get_habit_by_name(name: str) -> Optional[Habit]:
         Optional[Habit]: The habit object if found, otherwise None.
     """
     with SessionLocal() as session:
-        stmt = select(Habit).where(Habit.name == name)
-        return session.execute(stmt).scalar_one_or_none()
+        return session.execute(_SEL_HABIT_BY_NAME, {"name": name}).scalar_one_or_none()
     
+def _instance_row(habit: Habit, period_start: date) -> dict:
+    """
+    Builds the column values of a new, uncompleted instance for a bulk insert.
+
+    Args:
+        habit (Habit): The habit the instance belongs to.
+        period_start (date): The start date of the instance's period.
+
+    Returns:
+        dict: The habit_id, period_start, due_date and completed_at values.
+    """
+    return {
+        "habit_id": habit.id,
+        "period_start": period_start,
+        "due_date": _compute_due_date(habit.type, habit.weekday, period_start),
+        "completed_at": None,
+    }
+
 def backfill_instances():
     """
     Ensure every habit has a continuous sequence of HabitInstance records
     from its first period up through today.
 
     For each habit in the database:
-      1. Load the most recent HabitInstance (if any).
+      1. Look up the start of its most recent period (if any); the latest
+         period of every habit is read in one grouped query.
       2. If no instances exist yet, create the very first one starting at
          the habit's `first_period_start` for today.
       3. Repeatedly generate and persist new instances by calling
@@ -305,43 +443,44 @@ def backfill_instances():
     """
     today = date.today()
     with SessionLocal() as session:
-        for habit in session.query(Habit).all():
-            # find the most‐recent instance (if any)
-            last = (
-                session.query(HabitInstance)
-                        .filter_by(habit_id=habit.id)
-                        .order_by(HabitInstance.period_start.desc())
-                        .first()
-            )
+        new_rows: list[dict] = []
+        last_starts = dict(session.execute(_SEL_LAST_PERIOD_STARTS).all())
+        # stream the habits in batches instead of materializing them all up front
+        for habit in session.scalars(select(Habit).execution_options(yield_per=50)):
+            # find the start of the most‐recent period (if any)
+            current = last_starts.get(habit.id)
             # if there’s no instance, start one today (or via habit.first_period_start)
-            if last is None:
-                inst = HabitInstance(habit, habit.first_period_start(date.today()))
-                session.add(inst)
-                session.commit()
-                last = inst
-
-            # now, while last is “behind” today, spawn the next one
-            while last.period_start < today:
-                nxt = habit.next_period_start(last.period_start)
-                inst = HabitInstance(habit, nxt)
-                session.add(inst)
-                session.commit()
-                last = inst
+            if current is None:
+                current = habit.first_period_start(date.today())
+                new_rows.append(_instance_row(habit, current))
+
+            # now, while the latest period is “behind” today, spawn the next one
+            while current < today:
+                current = habit.next_period_start(current)
+                new_rows.append(_instance_row(habit, current))
+
+        # one executemany INSERT and one commit for the whole backfill; ids come from the column default
+        if new_rows:
+            session.execute(HabitInstance.__table__.insert(), new_rows)
+            session.commit()
                 
-def longest_streak_all(habits: list[Habit], all_instances: list[HabitInstance]) -> dict:
+def longest_streak_all(habits: list[Habit]) -> dict:
     """
     Computes the longest streak for each habit and finds the overall maximum.
 
     Args:
-        habits (list[Habit]): A list of all habits.
-        all_instances (list[HabitInstance]): A list of all habit instances.
+        habits (list[Habit]): A list of all habits with their instances loaded,
+                              as returned by `get_habits_with_instances`.
 
     Returns:
         dict: A dictionary containing the streaks per habit and the maximum overall streak.
     """
+    today = date.today()
     
     def streak_for(habit):
-        raw = current_streak_for_habit(habit)  # date or int
+        # the instances are already loaded newest first, so no query or sort per habit is needed
+        instances = [i for i in habit.instances if i.period_start <= today]
+        raw = count_current_streak(habit, instances, today)  # date or int
 
         if isinstance(raw, date):
             delta_days = (date.today() - raw).days
@@ -369,12 +508,14 @@ def delete_habit_by_id(habit_id: str) -> None:
         habit_id (str): The ID of the habit to delete.
     """
     with SessionLocal() as session:
-        session.execute(
-            delete(Habit)
-            .where(Habit.id == habit_id)
-        )
+        # delete the instances explicitly: databases created before the ON DELETE CASCADE
+        # foreign key have no cascade; on newer ones the cascade then has nothing left to remove
         session.execute(
             delete(HabitInstance)
             .where(HabitInstance.habit_id == habit_id)
         )
+        session.execute(
+            delete(Habit)
+            .where(Habit.id == habit_id)
+        )
         session.commit()
@@ -1,10 +1,9 @@
 from cli import cli
-import database
-import seed_data
 
 @cli.command("seed-db")
 def seed_db():
     """📊 Seeds the database with some sample data."""
+    import seed_data  # only needed by this command, so import on demand
     seed_data.seed_data()
 
 if __name__ == "__main__":
@@ -2,18 +2,48 @@ from datetime import datetime, date, timedelta
 from uuid import uuid4
 from typing import Optional
 from sqlalchemy import (
-    Column, String, DateTime, Date, ForeignKey, Integer, UniqueConstraint
+    Column, String, DateTime, Date, ForeignKey, Integer, UniqueConstraint, Index
 )
 from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.ext.hybrid import hybrid_method
 
 Base = declarative_base()
 
+_ONE_DAY = timedelta(days=1)    # period length of a daily habit, built once instead of per call
+_SIX_DAYS = timedelta(days=6)   # Monday to Sunday of the same week
+_DAYS = tuple(timedelta(days=n) for n in range(8))  # offsets 0-7 a weekly habit can advance by
+
+
+def _compute_due_date(habit_type: str, weekday: Optional[int], period_start: date) -> Optional[date]:
+    """
+    Calculate the due date of an instance starting at `period_start`.
+
+    Args:
+        habit_type (str): The habit's discriminator ('daily' or 'weekly').
+        weekday (Optional[int]): The weekday of a weekly habit, if it has one.
+        period_start (date): The start date of the period.
+
+    Returns:
+        Optional[date]: The period start for daily habits and weekly habits on a fixed weekday,
+                        the Sunday of that week for other weekly habits, otherwise None.
+    """
+    if habit_type == "daily":
+        return period_start
+    if habit_type != "weekly":
+        return None
+    if weekday is not None:
+        return period_start
+    return period_start + _SIX_DAYS - timedelta(days=period_start.weekday())
+
 class Habit(Base):
     """
     Base class representing a habit.
     """
     
     __tablename__ = 'habits'
+    __table_args__ = (
+      Index("ix_habit_name", "name", unique=True),
+    )
     
     id              = Column(String, primary_key=True, default=lambda: str(uuid4()))  # Unique identifier for the habit
     name            = Column(String, nullable=False)                                  # Name of the habit
@@ -28,7 +58,10 @@ class Habit(Base):
         'polymorphic_on': type 
     }
     
-    instances = relationship("HabitInstance", back_populates="habit")
+    instances = relationship(
+        "HabitInstance", back_populates="habit",
+        order_by="HabitInstance.period_start.desc()"   # newest first, as the streak calculations expect
+    )
     
     
     def __init__(self, name: str, description: Optional[str]):
@@ -81,7 +114,7 @@ class DailyHabit(Habit):
         Calculate the start of the next period for the habit after a given date. 
         For this habit type, it is always the next day.
         """
-        return after + timedelta(days=1)
+        return after + _ONE_DAY
     
     def get_data(self) -> dict:
         """
@@ -119,8 +152,8 @@ class WeeklyHabit(Habit):
         """
         current = after.weekday()   
         weekday = 0 if self.weekday is None else self.weekday                       # preventing NoneType error
-        days_ahead = (weekday - current + 7) % 7 if weekday is not current else 0   # calculate the days to advance | zero if weekday is today
-        return after + timedelta(days=days_ahead)
+        days_ahead = (weekday - current) % 7                                        # days to advance, 0-6 | zero if weekday is today
+        return after + _DAYS[days_ahead]
     
     def next_period_start(self, after: date) -> date:
         """
@@ -129,8 +162,8 @@ class WeeklyHabit(Habit):
         current = after.weekday() 
         weekday = 0 if self.weekday is None else self.weekday                       # preventing NoneType error   
         # advance to next `weekday` (e.g. 2 for Wednesday), at least 1 day ahead
-        days_ahead = (weekday - current + 7) % 7 if weekday is not current else 7   # calculate the days to advance | 7 if weekday is today to have habit next week
-        return after + timedelta(days=days_ahead)
+        days_ahead = (weekday - current - 1) % 7 + 1                                # days to advance, 1-7 | 7 if weekday is today to have habit next week
+        return after + _DAYS[days_ahead]
 
     def get_data(self) -> dict:
         """
@@ -151,10 +184,11 @@ class HabitInstance(Base):
     __tablename__ = "habit_instances"
     __table_args__ = (
       UniqueConstraint("habit_id", "period_start", name="uix_habit_period"),
+      Index("ix_instance_period_start", "period_start"),
     )
 
     id           = Column(String, primary_key=True, default=lambda: str(uuid4()))   # Unique identifier for the habit instance
-    habit_id     = Column(String, ForeignKey("habits.id"), nullable=False)          # Foreign key to the habits table
+    habit_id     = Column(String, ForeignKey("habits.id", ondelete="CASCADE"), nullable=False)  # Foreign key to the habits table
     period_start = Column(Date, nullable=False)                                     # The start date of the period for this instance
     due_date     = Column(Date, nullable=True)                                      # Optional due date for the habit
     completed_at = Column(DateTime, nullable=True)                                  # Timestamp of when the instance was completed
@@ -173,26 +207,28 @@ class HabitInstance(Base):
         self.id = str(uuid4())
         self.habit_id = str(habit.id)
         self.period_start = period_start
-        self.due_date = period_start if habit.type == 'daily' or (habit.type=="weekly" and habit.weekday is not None) else period_start + timedelta(days=6 - period_start.weekday()) if habit.type == 'weekly' else None
+        self.due_date = _compute_due_date(habit.type, habit.weekday, period_start)
         self.completed_at: Optional[datetime] = None
         
+    @hybrid_method
     def is_completed(self) -> bool:
         """
         Check if the habit instance is completed.
         """
-        if self.completed_at is None:
-            return False
-        else:
-            return True
+        return self.completed_at is not None
+    
+    @is_completed.expression
+    def is_completed(cls):
+        """
+        SQL form of `is_completed`, e.g. `select(HabitInstance).where(HabitInstance.is_completed())`.
+        """
+        return cls.completed_at.is_not(None)
         
     def mark_completed(self, completed_at: Optional[datetime] = None):
         """
         Mark the habit instance as completed.
         """
-        if completed_at:
-            self.completed_at = completed_at
-        else:
-            self.completed_at = datetime.now()
+        self.completed_at = completed_at or datetime.now()
         
         
     def get_data(self) -> dict:
@@ -1,12 +1,17 @@
 
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import random
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.orm import selectinload, sessionmaker
 from rich.console import Console
-from database import engine, SessionLocal, Base, backfill_instances
-from models import DailyHabit, WeeklyHabit, HabitInstance, Habit
+from database import engine, Base, backfill_instances
+from models import DailyHabit, WeeklyHabit, HabitInstance, Habit, _compute_due_date
 
 console = Console()
 
+# The seeder flushes explicitly and only writes, so queries skip the autoflush check
+SeedSession = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
 def seed_data():
     # Recreate database schema
     Base.metadata.drop_all(bind=engine)
@@ -21,13 +26,15 @@ def seed_data():
         WeeklyHabit(name="Review Goals", description="Every Sunday", weekday=6),
     ]
 
-    with SessionLocal() as session:
-        for habit in sample_habits:
-            session.add(habit)
-        session.commit()
+    with SeedSession() as session:
+        # habits and their initial instances go into the same transaction; flush so the
+        # habit rows exist before the instances referencing them are inserted
+        session.add_all(sample_habits)
+        session.flush()
 
         # 1. Create the very first instance for each habit, 4 weeks ago
-        for habit in session.query(Habit).all():
+        rows = []
+        for habit in sample_habits:
             # Calculate the start date for 4 weeks ago
             if isinstance(habit, WeeklyHabit):
                 today = date.today()
@@ -37,50 +44,44 @@ def seed_data():
             else:  # DailyHabit
                 start_date = date.today() - timedelta(days=27)
             
-            # Create the initial instance
-            initial_instance = HabitInstance(habit=habit, period_start=start_date)
-            session.add(initial_instance)
+            # Collect the initial instance as plain column values
+            rows.append({
+                "habit_id": habit.id,
+                "period_start": start_date,
+                "due_date": _compute_due_date(habit.type, habit.weekday, start_date),
+                "completed_at": None,
+            })
+
+        # insert all initial instances with one executemany; ids come from the column default
+        session.execute(HabitInstance.__table__.insert(), rows)
         session.commit()
 
     # 2. Backfill all missing instances up to today
     backfill_instances()
 
-    with SessionLocal() as session:
-        # 3. Randomly complete instances older than the last 4 periods
-        for habit in session.query(Habit).all():
-            # Determine the start of the 4-period pattern
+    with SeedSession() as session:
+        # load every habit with its instances once; steps 3 and 4 only collect what to complete
+        habits = session.scalars(select(Habit).options(selectinload(Habit.instances))).all()
+        today = date.today()
+        to_complete = []    # (habit_id, period_start) of every instance to mark completed
+
+        for habit in habits:
+            # Determine the start and period length of the 4-period pattern
             if isinstance(habit, WeeklyHabit):
-                today = date.today()
                 days_since_period_start = (today.weekday() - habit.weekday + 7) % 7
                 current_period_start = today - timedelta(days=days_since_period_start)
                 pattern_start_date = current_period_start - timedelta(weeks=3)
+                period_length = timedelta(weeks=1)
             else:  # DailyHabit
-                pattern_start_date = date.today() - timedelta(days=3)
-
-            # Get all instances before the pattern starts
-            instances_to_randomize = session.query(HabitInstance).filter(
-                HabitInstance.habit_id == habit.id,
-                HabitInstance.period_start < pattern_start_date
-            ).all()
-
-            for inst in instances_to_randomize:
-                if random.choice([True, False]):
-                    inst.mark_completed()
+                pattern_start_date = today - timedelta(days=3)
+                period_length = timedelta(days=1)
 
-        session.commit()
-
-        # 4. Apply the specific streak patterns for the last 4 periods
-        for habit in session.query(Habit).all():
-            # Determine the start date for the pattern
-            if isinstance(habit, WeeklyHabit):
-                today = date.today()
-                days_since_period_start = (today.weekday() - habit.weekday + 7) % 7
-                current_period_start = today - timedelta(days=days_since_period_start)
-                current = current_period_start - timedelta(weeks=3)
-            else:  # DailyHabit
-                current = date.today() - timedelta(days=3)
+            # 3. Randomly complete instances older than the last 4 periods
+            for inst in habit.instances:
+                if inst.period_start < pattern_start_date and random.getrandbits(1):
+                    to_complete.append((habit.id, inst.period_start))
 
-            # Define the pattern for the last 4 periods
+            # 4. Apply the specific streak patterns for the last 4 periods
             pattern = []
             if habit.name == "Brush Teeth":
                 pattern = [True, True, True, False]
@@ -91,13 +92,18 @@ def seed_data():
             else:  # Grocery Shopping, Review Goals
                 pattern = [True, False, True, False]
 
-            # Apply the pattern
-            for completed_flag in pattern:
-                inst = session.query(HabitInstance).filter_by(habit_id=habit.id, period_start=current).one()
+            # Apply the pattern; the periods are evenly spaced, so their starts are computed directly
+            for k, completed_flag in enumerate(pattern):
                 if completed_flag:
-                    inst.mark_completed()
-                current = habit.next_period_start(current)
-
+                    to_complete.append((habit.id, pattern_start_date + k * period_length))
+
+        # complete all selected instances with a single UPDATE
+        session.execute(
+            update(HabitInstance)
+            .where(tuple_(HabitInstance.habit_id, HabitInstance.period_start).in_(to_complete))
+            .values(completed_at=datetime.now()),
+            execution_options={"synchronize_session": False}
+        )
         session.commit()
 
     console.print("[bold green]Database seeded with 4 weeks of history and specific streak patterns.[/bold green]")
@@ -1,6 +1,8 @@
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
 from models import Base, DailyHabit, WeeklyHabit, HabitInstance, Habit
 import database
 import datetime
@@ -12,13 +14,28 @@ BASE_TEST_DATE = datetime.date(2025, 8, 4) # A Monday
 
 @pytest.fixture(scope="session")
 def engine():
-    return create_engine(f"sqlite:///{TEST_DB_PATH}")
+    engine = create_engine(f"sqlite:///{TEST_DB_PATH}")
+    # Apply the same connection PRAGMAs as the application engine (e.g. foreign key cascades)
+    event.listen(engine, "connect", database._set_sqlite_pragmas)
+
+    # pysqlite defers BEGIN and commits on SAVEPOINT release; let SQLAlchemy emit BEGIN itself
+    # so the per-test outer transaction (see db_session) really spans every savepoint
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _emit_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    return engine
 
 @pytest.fixture(scope="session")
 def tables(engine):
     Base.metadata.create_all(engine)
     yield
     Base.metadata.drop_all(engine)
+    engine.dispose()    # close pooled connections so SQLite removes its WAL files
     if os.path.exists(TEST_DB_PATH):
         os.remove(TEST_DB_PATH)
 
@@ -27,16 +44,22 @@ def db_session(engine, tables, monkeypatch):
     """
     Returns an sqlalchemy session, and after the test tears down everything properly.
     It also patches the database.SessionLocal to use the test database.
+
+    Every session of the test runs on one connection inside an outer transaction; their
+    commits only release SAVEPOINTs, and the whole test is rolled back at teardown.
     """
     # Patch the database module's engine and SessionLocal
     monkeypatch.setattr(database, "engine", engine)
-    
-    TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    monkeypatch.setattr(database, "SessionLocal", TestSessionLocal)
 
     connection = engine.connect()
     transaction = connection.begin()
     
+    TestSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False,
+        bind=connection, join_transaction_mode="create_savepoint"
+    )
+    monkeypatch.setattr(database, "SessionLocal", TestSessionLocal)
+    
     session = TestSessionLocal()
 
     yield session
@@ -101,6 +124,10 @@ def test_complete_task(db_session):
     completed_instance = db_session.query(HabitInstance).filter(HabitInstance.habit_id == habit.id, HabitInstance.period_start == BASE_TEST_DATE).one()
     assert completed_instance.is_completed()
 
+    # the same check evaluated in SQL; the next day's instance created by complete_task is still open
+    completed = db_session.query(HabitInstance).filter(HabitInstance.habit_id == habit.id, HabitInstance.is_completed()).all()
+    assert [i.period_start for i in completed] == [BASE_TEST_DATE]
+
 def test_get_all_habits(db_session):
     """
     Tests retrieving all habits from the database.
@@ -117,6 +144,14 @@ def test_get_all_habits(db_session):
     habits = database.get_all_habits()
     assert len(habits) == 2
 
+    # every column is loaded, so the detached habits stay fully usable
+    assert habits[1].get_data()["description"] == "Weekly habit 2"
+    assert habits[1].weekday == 1
+
+    # relationships are not loaded for the listing, and touching them raises instead of querying
+    with pytest.raises(InvalidRequestError):
+        habits[0].instances
+
 def test_get_daily_habits(db_session):
     """
     Tests retrieving only daily habits from the database.
@@ -149,6 +184,9 @@ def test_get_weekly_habits(db_session):
     assert len(habits) == 1
     assert habits[0].name == "Habit 6"
 
+    rows = database.get_all_habits_rows("weekly")
+    assert [(row.name, row.type) for row in rows] == [("Habit 6", "weekly")]
+
 def test_delete_habit(db_session):
     """
     Tests deleting a habit and its associated instances.
@@ -171,6 +209,29 @@ def test_delete_habit(db_session):
     instances = db_session.query(HabitInstance).filter(HabitInstance.habit_id == habit_id).all()
     assert len(instances) == 0
 
+def test_delete_habit_without_cascade_schema(monkeypatch, tmp_path):
+    """
+    Tests deleting a habit on a database created before the instances' foreign key cascaded.
+    """
+    legacy_engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    event.listen(legacy_engine, "connect", database._set_sqlite_pragmas)
+    with legacy_engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            ddl = str(CreateTable(table).compile(legacy_engine)).replace(" ON DELETE CASCADE", "")
+            conn.exec_driver_sql(ddl)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=legacy_engine, expire_on_commit=False))
+
+    habit = DailyHabit(name="Legacy", description="Created on an old schema.")
+    database.save_habit(habit)
+    database.save_instance(HabitInstance(habit=habit, period_start=BASE_TEST_DATE))
+
+    database.delete_habit_by_id(habit.id)
+
+    with legacy_engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM habit_instances").scalar() == 0
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM habits").scalar() == 0
+    legacy_engine.dispose()
+
 def test_current_streak(db_session):
     """
     Tests the calculation of the current streak for a habit.
@@ -195,3 +256,203 @@ def test_current_streak(db_session):
 
     streak = database.current_streak_for_habit(habit, today=BASE_TEST_DATE)
     assert streak == 3
+
+def test_get_active_habits_by_name(db_session):
+    """
+    Tests retrieving the instances of a single habit by its name.
+    """
+    db_session.query(Habit).delete()
+    db_session.query(HabitInstance).delete()
+    db_session.commit()
+
+    habit1 = DailyHabit(name="Filter Me", description="Daily habit to filter by.")
+    habit2 = DailyHabit(name="Other Habit", description="Should not be returned.")
+    database.save_habit(habit1)
+    database.save_habit(habit2)
+    database.save_instance(HabitInstance(habit=habit1, period_start=BASE_TEST_DATE))
+    database.save_instance(HabitInstance(habit=habit2, period_start=BASE_TEST_DATE))
+
+    instances = database.get_all_active_habits(name="Filter Me")
+    assert len(instances) == 1
+    assert instances[0].habit.name == "Filter Me"
+    assert database.get_all_active_habits(name="Unknown Habit") == []
+
+def test_longest_streak_all(db_session):
+    """
+    Tests computing the streaks of all habits from preloaded instances.
+    """
+    db_session.query(Habit).delete()
+    db_session.query(HabitInstance).delete()
+    db_session.commit()
+
+    today = datetime.date.today()
+    habit1 = DailyHabit(name="Streak All 1", description="Streak of two.")
+    habit2 = DailyHabit(name="Streak All 2", description="No streak.")
+    database.save_habit(habit1)
+    database.save_habit(habit2)
+
+    for i in range(3):
+        instance_date = today - datetime.timedelta(days=i)
+        database.save_instance(HabitInstance(habit=habit1, period_start=instance_date))
+        database.save_instance(HabitInstance(habit=habit2, period_start=instance_date))
+    database.complete_task(habit1.name, today - datetime.timedelta(days=1))
+    database.complete_task(habit1.name, today - datetime.timedelta(days=2))
+
+    result = database.longest_streak_all(database.get_habits_with_instances())
+    assert result["per_habit"] == {"Streak All 1": 2, "Streak All 2": 0}
+    assert result["max_of_all"] == 2
+
+def test_backfill_instances(db_session):
+    """
+    Tests that backfilling fills every missing period up to today.
+    """
+    db_session.query(Habit).delete()
+    db_session.query(HabitInstance).delete()
+    db_session.commit()
+
+    today = datetime.date.today()
+    habit = DailyHabit(name="Backfill Test", description="Test backfilling gaps.")
+    database.save_habit(habit)
+    database.save_instance(HabitInstance(habit=habit, period_start=today - datetime.timedelta(days=3)))
+
+    database.backfill_instances()
+
+    instances = db_session.query(HabitInstance).filter(HabitInstance.habit_id == habit.id).order_by(HabitInstance.period_start).all()
+    assert [i.period_start for i in instances] == [today - datetime.timedelta(days=d) for d in (3, 2, 1, 0)]
+
+def test_get_active_habits_query_count(db_session, engine):
+    """
+    Tests that listing active habits issues a fixed number of queries, independent of the row count.
+    """
+    db_session.query(Habit).delete()
+    db_session.query(HabitInstance).delete()
+    db_session.commit()
+
+    for i in range(3):
+        habit = WeeklyHabit(name=f"Query Count {i}", description="Test eager loading.", weekday=i)
+        database.save_habit(habit)
+        database.save_instance(HabitInstance(habit=habit, period_start=BASE_TEST_DATE))
+
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if "SAVEPOINT" not in statement:    # ignore the fixture's per-session savepoints
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        instances = database.get_all_active_habits()
+        names = [instance.habit.name for instance in instances]
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert len(names) == 3
+    assert len(statements) == 2  # the instances plus one selectin load of their habits
+
+def test_save_instance_existing_period(db_session):
+    """
+    Tests that saving a second instance for the same period returns the existing instance's ID.
+    """
+    habit = DailyHabit(name="Upsert Test", description="Test saving duplicate periods.")
+    database.save_habit(habit)
+
+    first = HabitInstance(habit=habit, period_start=BASE_TEST_DATE)
+    first_id = database.save_instance(first)
+    second_id = database.save_instance(HabitInstance(habit=habit, period_start=BASE_TEST_DATE))
+
+    assert first_id == first.id
+    assert second_id == first_id
+    assert db_session.query(HabitInstance).filter(HabitInstance.habit_id == habit.id).count() == 1
+
+def test_init_db_writes_schema_sentinel(db_session, monkeypatch, tmp_path):
+    """
+    Tests that init_db leaves a sentinel behind and skips table creation once it exists.
+    """
+    sentinel = tmp_path / ".schema_v1"
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "habits.db")
+    monkeypatch.setattr(database, "SCHEMA_SENTINEL", sentinel)
+    (tmp_path / "habits.db").touch()
+
+    database.init_db()
+    assert sentinel.exists()
+
+    calls = []
+    monkeypatch.setattr(database.Base.metadata, "create_all", lambda *args, **kwargs: calls.append(args))
+    database.init_db()
+    assert calls == []
+
+def test_add_habit_in_past_is_backfilled(db_session, monkeypatch):
+    """
+    Tests that a habit added with a past start date is backfilled by the next command in the same process.
+    """
+    from click.testing import CliRunner
+    import cli
+
+    monkeypatch.setattr(database, "init_db", lambda: None)
+    monkeypatch.setattr(cli, "_last_backfill_date", None)
+    runner = CliRunner()
+
+    assert runner.invoke(cli.cli, ["list-all-habits"]).exit_code == 0   # backfills once for today
+    start = datetime.date.today() - datetime.timedelta(days=5)
+    assert "added successfully" in runner.invoke(cli.cli, ["add-habit", "Past", "-s", start.isoformat()]).output
+    assert runner.invoke(cli.cli, ["list-all-active-habits", "-n", "Past"]).exit_code == 0
+
+    instances = db_session.query(HabitInstance).join(Habit).filter(Habit.name == "Past").all()
+    assert len(instances) == 6
+
+def test_emoji_prefix_widths():
+    """
+    Tests the display widths used to align the emoji column of the command help.
+    """
+    from cli import FixedWidthGroup
+
+    assert FixedWidthGroup.EMOJI_PREFIXES == {
+        "✨": 2, "✅": 2, "🗑️": 1, "𝌵": 2, "📋": 2, "📊": 2, "🏆": 2
+    }
+
+@pytest.mark.parametrize("habit, step", [
+    (DailyHabit(name="Parity Daily", description="SQL and Python streaks agree."), 1),
+    (WeeklyHabit(name="Parity Weekly", description="SQL and Python streaks agree.", weekday=0), 7),
+])
+def test_current_streak_sql_matches_python(db_session, habit, step):
+    """
+    Tests that the SQL streak query and the in-memory streak walk agree on the same history.
+    """
+    database.save_habit(habit)
+    today = BASE_TEST_DATE + datetime.timedelta(days=10 * step)
+
+    # periods 0-12: period 4 is missing, 2 is open, 5-9 are completed, 10 (today) is still open, 11-12 lie in the future
+    for k in range(13):
+        if k == 4:
+            continue
+        instance = HabitInstance(habit=habit, period_start=BASE_TEST_DATE + datetime.timedelta(days=k * step))
+        if k not in (2, 10):
+            instance.mark_completed()
+        database.save_instance(instance)
+
+    instances = db_session.query(HabitInstance).filter(
+        HabitInstance.habit_id == habit.id, HabitInstance.period_start <= today
+    ).order_by(HabitInstance.period_start.desc()).all()
+
+    expected = database.count_current_streak(habit, instances, today)
+    assert expected == 5
+    assert database.current_streak_for_habit(habit, today) == expected
+
+def test_complete_task_with_date_option(db_session, monkeypatch):
+    """
+    Tests completing a past instance through the CLI's --date option.
+    """
+    from click.testing import CliRunner
+    import cli
+
+    monkeypatch.setattr(database, "init_db", lambda: None)
+    habit = DailyHabit(name="Dated", description="Completed for a given date.")
+    database.save_habit(habit)
+    database.save_instance(HabitInstance(habit=habit, period_start=BASE_TEST_DATE))
+
+    result = CliRunner().invoke(cli.cli, ["complete-task", "Dated", "-d", BASE_TEST_DATE.isoformat()])
+    assert "marked as completed" in result.output
+
+    instance = db_session.query(HabitInstance).filter(
+        HabitInstance.habit_id == habit.id, HabitInstance.period_start == BASE_TEST_DATE
+    ).one()
+    assert instance.is_completed()